@@ -1,15 +1,60 @@
+import asyncio
 import os
-from datetime import datetime
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends
+import msgspec
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from redis import asyncio as aioredis
 
-from database import db, create_document, get_documents
+from database import db, close_client, ping, create_document, get_documents
 
-app = FastAPI(title="Clothing Store API")
+# Optional Redis cache for read-mostly product data (set REDIS_URL to enable)
+redis_client = None
+CACHE_TTL = 60
+
+ph = PasswordHasher()
+
+
+async def ensure_indexes():
+    """Create indexes backing the hot query paths (email lookups, created_at sorts, monthly report)."""
+    await db["user"].create_index("email", unique=True, background=True)
+    await db["product"].create_index([("created_at", -1)], background=True)
+    await db["order"].create_index([("created_at", -1)], background=True)
+    await db["order"].create_index([("status", 1), ("created_at", 1)], background=True)
+    # Covering index for the monthly report pipeline ($match on created_at, $group on status/subtotal)
+    await db["order"].create_index([("created_at", 1), ("status", 1), ("subtotal", 1)], background=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        redis_client = aioredis.from_url(redis_url)
+    if db is not None:
+        await ping()
+        await ensure_indexes()
+    yield
+    if redis_client is not None:
+        await redis_client.aclose()
+    close_client()
+
+
+app = FastAPI(title="Clothing Store API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,13 +77,69 @@ class ObjectIdStr(str):
         return str(v)
 
 
+async def cache_get(key: str):
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(key)
+    except Exception:
+        return None
+
+
+async def cache_set(key: str, payload: bytes):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(key, payload, ex=CACHE_TTL)
+    except Exception:
+        pass
+
+
+async def cache_delete(*keys: str):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception:
+        pass
+
+
+async def stream_docs(cursor, cache_key=None):
+    """Yield a JSON array chunk-by-chunk from a Motor cursor, optionally caching the full payload."""
+    caching = cache_key is not None and redis_client is not None
+    chunks = [b"["] if caching else None
+    yield b"["
+    first = True
+    async for doc in cursor:
+        chunk = (b"" if first else b",") + orjson.dumps(to_dict(doc))
+        first = False
+        if caching:
+            chunks.append(chunk)
+        yield chunk
+    yield b"]"
+    if caching:
+        chunks.append(b"]")
+        await cache_set(cache_key, b"".join(chunks))
+
+
+_OID_RE = re.compile(r"^[0-9a-fA-F]{24}$")
+
+
+def _oid(s: str) -> ObjectId:
+    """Validate a 24-hex-char ID with a precompiled regex and convert it, or raise a 400."""
+    if not _OID_RE.match(s):
+        raise HTTPException(status_code=400, detail="Invalid ID")
+    return ObjectId(s)
+
+
 def to_dict(doc):
+    # Motor hands back a fresh dict per document, so mutating in place
+    # avoids a full copy per row on the list endpoints.
     if not doc:
         return doc
-    d = dict(doc)
-    if "_id" in d:
-        d["id"] = str(d.pop("_id"))
-    return d
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
 
 
 # Auth models (very basic demo auth - not production ready)
@@ -54,11 +155,11 @@ class LoginRequest(BaseModel):
     password: str
 
 
-# Product models
-class ProductIn(BaseModel):
+# Product models (msgspec Structs decode the hot POST bodies without Pydantic overhead)
+class ProductIn(msgspec.Struct):
     title: str
-    description: Optional[str] = None
     price: float
+    description: Optional[str] = None
     category: Optional[str] = None
     image_url: Optional[str] = None
     in_stock: bool = True
@@ -74,14 +175,14 @@ class ProductUpdate(BaseModel):
 
 
 # Order models
-class OrderItemIn(BaseModel):
+class OrderItemIn(msgspec.Struct):
     product_id: str
     title: str
     price: float
     quantity: int
 
 
-class CreateOrderRequest(BaseModel):
+class CreateOrderRequest(msgspec.Struct):
     customer_name: str
     customer_email: str
     shipping_address: str
@@ -97,8 +198,13 @@ async def root():
     return {"message": "Clothing Store API running"}
 
 
+# /test doubles as a liveness probe, so cache the collection listing briefly
+# instead of issuing the admin command on every hit
+_collections_cache = {"t": 0.0, "v": None}
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -106,42 +212,50 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Connected"
-            response["collections"] = db.list_collection_names()[:10]
+            if _collections_cache["v"] is None or time.monotonic() - _collections_cache["t"] > 5:
+                _collections_cache["v"] = (await db.list_collection_names())[:10]
+                _collections_cache["t"] = time.monotonic()
+            response["collections"] = _collections_cache["v"]
     except Exception as e:
         response["database"] = f"⚠️ {str(e)[:80]}"
     return response
 
 
-# Auth endpoints (very simple; plain-text password for demo)
+# Auth endpoints (argon2-hashed passwords; the KDF runs in a thread so it never blocks the event loop)
 @app.post("/auth/register")
-def register(req: RegisterRequest):
+async def register(req: RegisterRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    existing = db["user"].find_one({"email": req.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
+    password_hash = await asyncio.to_thread(ph.hash, req.password)
+    now = datetime.now(timezone.utc)
     user_doc = {
         "name": req.name,
         "email": req.email,
-        "password": req.password,  # In production, hash this!
+        "password_hash": password_hash,
         "role": req.role,
         "is_active": True,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
-    result = db["user"].insert_one(user_doc)
+    try:
+        result = await db["user"].insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"id": str(result.inserted_id), "name": req.name, "email": req.email, "role": req.role}
 
 
 @app.post("/auth/login")
-def login(req: LoginRequest):
+async def login(req: LoginRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    user = db["user"].find_one({"email": req.email, "password": req.password})
-    if not user:
+    user = await db["user"].find_one({"email": req.email})
+    if not user or "password_hash" not in user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        await asyncio.to_thread(ph.verify, user["password_hash"], req.password)
+    except VerifyMismatchError:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     return {"id": str(user.get("_id")), "name": user.get("name"), "email": user.get("email"), "role": user.get("role", "user")}
@@ -149,141 +263,203 @@ def login(req: LoginRequest):
 
 # Products CRUD (admin)
 @app.post("/products")
-def create_product(p: ProductIn):
+async def create_product(request: Request):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    doc = p.model_dump()
-    doc["created_at"] = datetime.utcnow()
-    doc["updated_at"] = datetime.utcnow()
-    res = db["product"].insert_one(doc)
-    return {"id": str(res.inserted_id), **p.model_dump()}
+    body = await request.body()
+    try:
+        p = msgspec.json.decode(body, type=ProductIn)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    now = datetime.now(timezone.utc)
+    doc = msgspec.to_builtins(p)
+    doc["created_at"] = now
+    doc["updated_at"] = now
+    res = await db["product"].insert_one(doc)
+    await cache_delete("products:all")
+    return {"id": str(res.inserted_id), **{k: v for k, v in doc.items() if k != "_id"}}
 
 
 @app.get("/products")
-def list_products():
+async def list_products():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    products = [to_dict(p) for p in db["product"].find().sort("created_at", -1)]
-    return products
+    cached = await cache_get("products:all")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    projection = {"title": 1, "price": 1, "category": 1, "image_url": 1, "in_stock": 1, "created_at": 1}
+    cursor = db["product"].find({}, projection).sort("created_at", -1)
+    return StreamingResponse(stream_docs(cursor, cache_key="products:all"), media_type="application/json")
 
 
 @app.get("/products/{product_id}")
-def get_product(product_id: str):
+async def get_product(product_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        doc = db["product"].find_one({"_id": ObjectId(product_id)})
-        if not doc:
-            raise HTTPException(status_code=404, detail="Not found")
-        return to_dict(doc)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid ID")
+    oid = _oid(product_id)
+    cache_key = f"product:{oid}"
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    doc = await db["product"].find_one({"_id": oid})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Not found")
+    result = to_dict(doc)
+    await cache_set(cache_key, orjson.dumps(result))
+    return result
 
 
 @app.put("/products/{product_id}")
-def update_product(product_id: str, payload: ProductUpdate):
+async def update_product(product_id: str, payload: ProductUpdate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
+    oid = _oid(product_id)
     updates = {k: v for k, v in payload.model_dump().items() if v is not None}
     if not updates:
         return {"updated": False}
-    updates["updated_at"] = datetime.utcnow()
-    try:
-        res = db["product"].update_one({"_id": ObjectId(product_id)}, {"$set": updates})
-        if res.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Not found")
-        return {"updated": True}
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid ID")
+    updates["updated_at"] = datetime.now(timezone.utc)
+    res = await db["product"].update_one({"_id": oid}, {"$set": updates})
+    if res.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Not found")
+    await cache_delete("products:all", f"product:{oid}")
+    return {"updated": True}
 
 
 @app.delete("/products/{product_id}")
-def delete_product(product_id: str):
+async def delete_product(product_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        res = db["product"].delete_one({"_id": ObjectId(product_id)})
-        if res.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Not found")
-        return {"deleted": True}
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid ID")
+    oid = _oid(product_id)
+    res = await db["product"].delete_one({"_id": oid})
+    if res.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Not found")
+    await cache_delete("products:all", f"product:{oid}")
+    return {"deleted": True}
 
 
 # Orders
 @app.post("/orders")
-def create_order(req: CreateOrderRequest):
+async def create_order(request: Request):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
-    # compute subtotal from items
-    subtotal = sum(item.price * item.quantity for item in req.items)
+    body = await request.body()
+    try:
+        req = msgspec.json.decode(body, type=CreateOrderRequest)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # dump each item once and price it from the product collection rather
+    # than trusting the client-supplied price
+    items = []
+    ids = []
+    for item in req.items:
+        d = msgspec.to_builtins(item)
+        ids.append(_oid(d["product_id"]))
+        items.append(d)
+    prices = {str(p["_id"]): p["price"] async for p in db["product"].find({"_id": {"$in": ids}}, {"price": 1})}
+    subtotal = 0.0
+    for oid, d in zip(ids, items):
+        price = prices.get(str(oid))
+        if price is None:
+            raise HTTPException(status_code=400, detail=f"Unknown product: {d['product_id']}")
+        d["price"] = price
+        subtotal += price * d["quantity"]
+    now = datetime.now(timezone.utc)
     doc = {
         "customer_name": req.customer_name,
         "customer_email": req.customer_email,
         "shipping_address": req.shipping_address,
-        "items": [i.model_dump() for i in req.items],
+        "items": items,
         "subtotal": round(subtotal, 2),
         "status": "pending",
         "payment_method": "qr",
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
-    res = db["order"].insert_one(doc)
+    res = await db["order"].insert_one(doc)
     return {"id": str(res.inserted_id), **{k: v for k, v in doc.items() if k != "_id"}}
 
 
 @app.get("/orders")
-def list_orders():
+async def list_orders():
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    cursor = db["order"].find().sort("created_at", -1)
+    return StreamingResponse(stream_docs(cursor), media_type="application/json")
+
+
+@app.get("/orders/summary")
+async def list_orders_summary():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    orders = [to_dict(o) for o in db["order"].find().sort("created_at", -1)]
+    projection = {"customer_name": 1, "subtotal": 1, "status": 1, "created_at": 1}
+    orders = [to_dict(o) async for o in db["order"].find({}, projection).sort("created_at", -1)]
     return orders
 
 
 @app.post("/orders/mark-paid")
-def mark_paid(payload: MarkPaidRequest):
+async def mark_paid(payload: MarkPaidRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        res = db["order"].update_one({"_id": ObjectId(payload.order_id)}, {"$set": {"status": "paid", "paid_at": datetime.utcnow(), "updated_at": datetime.utcnow()}})
-        if res.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Order not found")
-        return {"updated": True}
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid ID")
+    oid = _oid(payload.order_id)
+    now = datetime.now(timezone.utc)
+    doc = await db["order"].find_one_and_update(
+        {"_id": oid},
+        {"$set": {"status": "paid", "paid_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+        projection={"_id": 1, "status": 1, "paid_at": 1},
+    )
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return to_dict(doc)
 
 
 # Simple monthly report (orders summary)
+@lru_cache(maxsize=32)
+def _month_bounds(y: int, m: int):
+    start = datetime(y, m, 1)
+    end = datetime(y + 1, 1, 1) if m == 12 else datetime(y, m + 1, 1)
+    return start, end
+
+
 @app.get("/reports/monthly")
-def monthly_report(year: Optional[int] = None, month: Optional[int] = None):
+async def monthly_report(year: Optional[int] = None, month: Optional[int] = None):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    from datetime import datetime as dt
-    now = dt.utcnow()
+    now = datetime.now(timezone.utc)
     y = year or now.year
     m = month or now.month
-
-    start = dt(y, m, 1)
-    if m == 12:
-        end = dt(y + 1, 1, 1)
-    else:
-        end = dt(y, m + 1, 1)
+    start, end = _month_bounds(y, m)
 
     pipeline = [
         {"$match": {"created_at": {"$gte": start, "$lt": end}}},
-        {"$group": {"_id": "$status", "count": {"$sum": 1}, "revenue": {"$sum": "$subtotal"}}},
+        {"$facet": {
+            "by_status": [
+                {"$group": {"_id": "$status", "count": {"$sum": 1}, "revenue": {"$sum": "$subtotal"}}},
+            ],
+            "totals": [
+                {"$group": {"_id": None, "total_orders": {"$sum": 1}, "total_revenue": {"$sum": "$subtotal"}}},
+            ],
+        }},
     ]
-    agg = list(db["order"].aggregate(pipeline))
-    summary = {row["_id"]: {"orders": row["count"], "revenue": round(row["revenue"], 2)} for row in agg}
-    total_orders = sum(row["count"] for row in agg) if agg else 0
-    total_revenue = round(sum(row["revenue"] for row in agg), 2) if agg else 0.0
+    cursor = db["order"].aggregate(
+        pipeline,
+        hint={"created_at": 1, "status": 1, "subtotal": 1},
+        allowDiskUse=False,
+    )
+    result = await cursor.to_list(length=1)
+    by_status = result[0]["by_status"]
+    totals = result[0]["totals"][0] if result[0]["totals"] else {"total_orders": 0, "total_revenue": 0.0}
+    summary = {row["_id"]: {"orders": row["count"], "revenue": round(row["revenue"], 2)} for row in by_status}
 
-    return {"year": y, "month": m, "summary": summary, "total_orders": total_orders, "total_revenue": total_revenue}
+    return {"year": y, "month": m, "summary": summary, "total_orders": totals["total_orders"], "total_revenue": round(totals["total_revenue"], 2)}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")
@@ -13,7 +13,7 @@ from datetime import datetime
 class User(BaseModel):
     name: str = Field(..., description="Full name")
     email: str = Field(..., description="Email address")
-    password: str = Field(..., description="Plain text password (will be hashed)")
+    password_hash: str = Field(..., description="Argon2 password hash")
     role: str = Field("user", description="user or admin")
     is_active: bool = Field(True)
 